@@ -1,83 +1,170 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.db.database import get_db
+from sqlalchemy import and_, desc, or_
+from app.core.config import settings
+from app.db.crud import upsert_conversation
+from app.db.database import get_db, SessionLocal
+from app.db.spool import conversation_spool
 from app.models.conversation import Conversation
 from app.schemas.conversation import ConversationSchema, ConversationResponse, ErrorResponse
-from datetime import datetime
+from typing import Optional
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+STREAM_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_meta(meta):
+    """解析存储的JSON字符串"""
+    if meta is None:
+        return None
+    if isinstance(meta, str):
+        try:
+            return json.loads(meta)
+        except Exception:
+            return meta
+    return meta
+
+
+def conversation_to_dict(conv: Conversation) -> dict:
+    return {
+        "id": conv.id,
+        "platform": conv.platform,
+        "title": conv.title,
+        "url": conv.url,
+        "createdAt": conv.created_at.isoformat() if conv.created_at else None,
+        "updatedAt": conv.updated_at.isoformat() if conv.updated_at else None,
+        "messages": conv.messages,
+        "processed": conv.processed,
+        "processedAt": conv.processed_at.isoformat() if conv.processed_at else None,
+        "tags": conv.tags,
+        "summary": conv.summary,
+        # 使用模型属性名 meta_data（字符串时解析）
+        "metadata": parse_meta(conv.meta_data)
+    }
+
+
+def build_conversations_query(db: Session, platform: Optional[str], processed: Optional[bool]):
+    query = db.query(Conversation)
+
+    if platform:
+        query = query.filter(Conversation.platform == platform)
+
+    if processed is not None:
+        query = query.filter(Conversation.processed == processed)
+
+    # 按更新时间倒序排列，id 作为并列时的稳定次序（流式响应的键集分页依赖它）
+    return query.order_by(desc(Conversation.updated_at), desc(Conversation.id))
+
+
+def fetch_stream_batch(
+    platform: Optional[str],
+    processed: Optional[bool],
+    skip: int,
+    last: Optional[tuple],
+    size: int
+):
+    """用独立的短会话读取一批并编码，返回 (编码后的对象列表, 键集位置)
+
+    每批查询后立即关闭会话：不能在等待客户端读取时持有游标，否则 SQLite 的共享锁会阻塞所有写入。
+    """
+    db = SessionLocal()
+    try:
+        query = build_conversations_query(db, platform, processed)
+        if last is None:
+            query = query.offset(skip)
+        else:
+            last_updated_at, last_id = last
+            query = query.filter(or_(
+                Conversation.updated_at < last_updated_at,
+                and_(Conversation.updated_at == last_updated_at, Conversation.id < last_id)
+            ))
+        rows = query.limit(size).all()
+        encoded = [json.dumps(conversation_to_dict(conv), ensure_ascii=False) for conv in rows]
+        return encoded, ((rows[-1].updated_at, rows[-1].id) if rows else last)
+    finally:
+        db.close()
+
+
+def iter_conversations_stream(
+    stream: str,
+    first_batch: list,
+    last: Optional[tuple],
+    limit: int,
+    platform: Optional[str],
+    processed: Optional[bool]
+):
+    """逐批编码输出对话列表，内存占用与 STREAM_BATCH_SIZE 相关而与结果总量无关
+
+    第一批已在路由中读取（出错时仍可返回 500），其余批次按 (updated_at, id) 键集分页读取。
+    """
+    batch_size = settings.STREAM_BATCH_SIZE
+    encoded = first_batch
+    remaining = limit
+    sent = 0
+    try:
+        if stream == "json":
+            yield b"["
+        while encoded:
+            if stream == "json":
+                chunk = ",".join(encoded)
+                yield (chunk if sent == 0 else "," + chunk).encode("utf-8")
+            else:
+                yield "".join(item + "\n" for item in encoded).encode("utf-8")
+            sent += len(encoded)
+            remaining -= len(encoded)
+            if remaining <= 0 or len(encoded) < batch_size:
+                break
+            encoded, last = fetch_stream_batch(platform, processed, 0, last, min(batch_size, remaining))
+        if stream == "json":
+            yield b"]"
+    except Exception as e:
+        # 响应头已发送，只能记录错误并截断响应
+        logger.error(f"Error streaming conversations: {str(e)}")
+        raise
+
+
 @router.post("/conversations", response_model=ConversationResponse)
 async def create_or_update_conversation(
     conversation: ConversationSchema,
+    response: Response,
     db: Session = Depends(get_db)
 ):
-    try:
-        # 转换时间字符串为datetime对象
-        created_at = datetime.fromisoformat(conversation.createdAt.replace('Z', '+00:00'))
-        updated_at = datetime.fromisoformat(conversation.updatedAt.replace('Z', '+00:00'))
-        processed_at = None
-        if conversation.processedAt:
-            processed_at = datetime.fromisoformat(conversation.processedAt.replace('Z', '+00:00'))
-        
-        existing = db.query(Conversation).filter(Conversation.id == conversation.id).first()
-        
-        if existing:
-            # 更新现有对话
-            existing.platform = conversation.platform
-            existing.title = conversation.title
-            existing.url = conversation.url
-            existing.created_at = created_at
-            existing.updated_at = updated_at
-            existing.messages = [msg.dict() for msg in conversation.messages]
-            existing.processed = conversation.processed
-            existing.processed_at = processed_at
-            existing.tags = conversation.tags
-            existing.summary = conversation.summary
-            # 注意: 模型属性名是 meta_data，数据库列名为 'metadata'；存储为JSON字符串
-            existing.meta_data = json.dumps(conversation.metadata, ensure_ascii=False) if conversation.metadata is not None else None
-            
-            db.commit()
-            db.refresh(existing)
-            
-            logger.info(f"Conversation updated: {conversation.id}")
-            return ConversationResponse(
-                id=existing.id,
-                status="updated",
-                message="Conversation updated successfully"
-            )
-        else:
-            # 创建新对话
-            new_conversation = Conversation(
-                id=conversation.id,
-                platform=conversation.platform,
-                title=conversation.title,
-                url=conversation.url,
-                created_at=created_at,
-                updated_at=updated_at,
-                messages=[msg.dict() for msg in conversation.messages],
-                processed=conversation.processed,
-                processed_at=processed_at,
-                tags=conversation.tags,
-                summary=conversation.summary,
-                # 模型属性名是 meta_data，数据库列名为 'metadata'；存储为JSON字符串
-                meta_data=json.dumps(conversation.metadata, ensure_ascii=False) if conversation.metadata is not None else None
-            )
-            
-            db.add(new_conversation)
-            db.commit()
-            db.refresh(new_conversation)
-            
-            logger.info(f"Conversation created: {conversation.id}")
-            return ConversationResponse(
-                id=new_conversation.id,
-                status="created",
-                message="Conversation created successfully"
+    if settings.INGEST_MODE == "spool":
+        # 写前日志模式：记录落盘后立即返回 202，由后台批量写入数据库
+        try:
+            await conversation_spool.append(conversation.dict())
+        except Exception as e:
+            logger.error(f"Spool error in create_or_update_conversation: {str(e)}")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Ingestion spool unavailable: {str(e)}"
             )
+
+        response.status_code = 202
+        return ConversationResponse(
+            id=conversation.id,
+            status="accepted",
+            message="Conversation accepted for ingestion"
+        )
+
+    try:
+        status = upsert_conversation(db, conversation)
+        db.commit()
+
+        logger.info(f"Conversation {status}: {conversation.id}")
+        return ConversationResponse(
+            id=conversation.id,
+            status=status,
+            message=f"Conversation {status} successfully"
+        )
             
     except Exception as e:
         db.rollback()
@@ -97,32 +184,7 @@ async def get_conversation(
         if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
-        # 解析存储的JSON字符串
-        def parse_meta(meta):
-            if meta is None:
-                return None
-            if isinstance(meta, str):
-                try:
-                    return json.loads(meta)
-                except Exception:
-                    return meta
-            return meta
-
-        return {
-            "id": conversation.id,
-            "platform": conversation.platform,
-            "title": conversation.title,
-            "url": conversation.url,
-            "createdAt": conversation.created_at.isoformat() if conversation.created_at else None,
-            "updatedAt": conversation.updated_at.isoformat() if conversation.updated_at else None,
-            "messages": conversation.messages,
-            "processed": conversation.processed,
-            "processedAt": conversation.processed_at.isoformat() if conversation.processed_at else None,
-            "tags": conversation.tags,
-            "summary": conversation.summary,
-            # 使用模型属性名 meta_data（字符串时解析）
-            "metadata": parse_meta(conversation.meta_data)
-        }
+        return conversation_to_dict(conversation)
     except HTTPException:
         raise
     except Exception as e:
@@ -135,48 +197,26 @@ async def get_conversations(
     limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
     platform: str = Query(None, description="Filter by platform"),
     processed: bool = Query(None, description="Filter by processed status"),
+    stream: Optional[str] = Query(
+        None,
+        pattern="^(json|ndjson)$",
+        description="Stream the response incrementally as a JSON array (json) or newline-delimited JSON (ndjson)"
+    ),
     db: Session = Depends(get_db)
 ):
     try:
-        query = db.query(Conversation)
-        
-        if platform:
-            query = query.filter(Conversation.platform == platform)
-        
-        if processed is not None:
-            query = query.filter(Conversation.processed == processed)
-        
-        # 按更新时间倒序排列
-        conversations = query.order_by(desc(Conversation.updated_at)).offset(skip).limit(limit).all()
-        
-        def parse_meta(meta):
-            if meta is None:
-                return None
-            if isinstance(meta, str):
-                try:
-                    return json.loads(meta)
-                except Exception:
-                    return meta
-            return meta
+        if stream:
+            # 先在路由内读取第一批：数据库错误仍能返回 500，而不是 200 加截断的响应体
+            first_batch, last = fetch_stream_batch(
+                platform, processed, skip, None, min(settings.STREAM_BATCH_SIZE, limit)
+            )
+            return StreamingResponse(
+                iter_conversations_stream(stream, first_batch, last, limit, platform, processed),
+                media_type=STREAM_MEDIA_TYPES[stream]
+            )
 
-        return [
-            {
-                "id": conv.id,
-                "platform": conv.platform,
-                "title": conv.title,
-                "url": conv.url,
-                "createdAt": conv.created_at.isoformat() if conv.created_at else None,
-                "updatedAt": conv.updated_at.isoformat() if conv.updated_at else None,
-                "messages": conv.messages,
-                "processed": conv.processed,
-                "processedAt": conv.processed_at.isoformat() if conv.processed_at else None,
-                "tags": conv.tags,
-                "summary": conv.summary,
-                # 使用模型属性名 meta_data（字符串时解析）
-                "metadata": parse_meta(conv.meta_data)
-            }
-            for conv in conversations
-        ]
+        conversations = build_conversations_query(db, platform, processed).offset(skip).limit(limit).all()
+        return [conversation_to_dict(conv) for conv in conversations]
     except Exception as e:
         logger.error(f"Error getting conversations: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from app.db.database import get_db
+from app.models.stats import ConversationDailyStats
+from datetime import date
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def summarize(conversations: int, processed: int, messages: int, message_chars: int) -> dict:
+    conversations = conversations or 0
+    processed = processed or 0
+    messages = messages or 0
+    message_chars = message_chars or 0
+    return {
+        "conversations": conversations,
+        "processed": processed,
+        "unprocessed": conversations - processed,
+        "messages": messages,
+        "avgMessagesPerConversation": round(messages / conversations, 2) if conversations else 0,
+        "avgMessageSize": round(message_chars / messages, 2) if messages else 0,
+    }
+
+
+@router.get("/stats")
+async def get_stats(
+    platform: str = Query(None, description="Filter by platform"),
+    start: date = Query(None, description="First day (inclusive, UTC date of conversation createdAt)"),
+    end: date = Query(None, description="Last day (inclusive, UTC date of conversation createdAt)"),
+    db: Session = Depends(get_db)
+):
+    """使用统计：只读取增量维护的汇总表，不扫描 conversations"""
+    try:
+        query = db.query(ConversationDailyStats)
+
+        if platform:
+            query = query.filter(ConversationDailyStats.platform == platform)
+        if start:
+            query = query.filter(ConversationDailyStats.day >= start)
+        if end:
+            query = query.filter(ConversationDailyStats.day <= end)
+
+        counters = (
+            func.sum(ConversationDailyStats.conversations),
+            func.sum(ConversationDailyStats.processed_conversations),
+            func.sum(ConversationDailyStats.messages),
+            func.sum(ConversationDailyStats.message_chars),
+        )
+
+        totals = query.with_entities(*counters).one()
+        platforms = (
+            query.with_entities(ConversationDailyStats.platform, *counters)
+            .group_by(ConversationDailyStats.platform)
+            .order_by(ConversationDailyStats.platform)
+            .all()
+        )
+        daily = (
+            query.filter(ConversationDailyStats.conversations > 0)
+            .order_by(ConversationDailyStats.day, ConversationDailyStats.platform)
+            .all()
+        )
+
+        return {
+            "totals": summarize(*totals),
+            "platforms": [
+                {"platform": row[0], **summarize(*row[1:])}
+                for row in platforms
+            ],
+            "daily": [
+                {
+                    "day": row.day.isoformat(),
+                    "platform": row.platform,
+                    **summarize(row.conversations, row.processed_conversations, row.messages, row.message_chars)
+                }
+                for row in daily
+            ],
+        }
+    except Exception as e:
+        logger.error(f"Error getting stats: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -0,0 +1,162 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只使用 gzip
+    brotli = None
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """解析 Accept-Encoding，返回客户端接受的编码（忽略 q=0）"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(token)
+    return accepted
+
+
+class _GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self):
+        # wbits=31 输出带 gzip 头的流
+        self._obj = zlib.compressobj(settings.GZIP_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+    def process(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class _BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self):
+        self._obj = brotli.Compressor(quality=settings.BROTLI_COMPRESSION_QUALITY)
+
+    def process(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def finish(self) -> bytes:
+        return self._obj.finish()
+
+
+class CompressionMiddleware:
+    """按 Accept-Encoding 协商 br/gzip 压缩的 ASGI 中间件
+
+    - 单块响应小于 minimum_size 时原样返回，避免小响应的压缩开销
+    - 流式响应（more_body=True）逐块压缩，内存占用与响应大小无关
+    - 已设置 Content-Encoding 的响应不再重复压缩
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            compressor_cls = _BrotliCompressor
+        elif "gzip" in accepted:
+            compressor_cls = _GzipCompressor
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self.app, compressor_cls, self.minimum_size)
+        await responder(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, compressor_cls, minimum_size: int):
+        self.app = app
+        self.compressor_cls = compressor_cls
+        self.minimum_size = minimum_size
+        self.send: Send = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.compressor = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # 延迟发送响应头，直到看到第一块响应体再决定是否压缩
+            self.initial_message = message
+            return
+
+        if message_type != "http.response.body":
+            await self.send(message)
+            return
+
+        if self.started:
+            if self.compressor is None:
+                await self.send(message)
+            else:
+                await self._send_compressed(message)
+            return
+
+        self.started = True
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+
+        if "content-encoding" in headers or (not more_body and len(body) < self.minimum_size):
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+
+        self.compressor = self.compressor_cls()
+        headers["Content-Encoding"] = self.compressor.encoding
+        headers.add_vary_header("Accept-Encoding")
+
+        if not more_body:
+            # 单块响应：压缩完成后即可确定 Content-Length
+            compressed = self.compressor.process(body) + self.compressor.finish()
+            headers["Content-Length"] = str(len(compressed))
+            await self.send(self.initial_message)
+            await self.send({"type": "http.response.body", "body": compressed})
+            return
+
+        # 流式响应长度未知，改用分块传输
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        await self.send(self.initial_message)
+        await self._send_compressed(message)
+
+    async def _send_compressed(self, message: Message) -> None:
+        body = self.compressor.process(message.get("body", b""))
+        more_body = message.get("more_body", False)
+        if not more_body:
+            body += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+
+def add_compression_middleware(app):
+    # 大列表响应（尤其是流式 JSON/NDJSON）压缩后体积通常下降一个数量级
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MINIMUM_SIZE)
@@ -24,6 +24,22 @@ class Settings(BaseSettings):
     CORS_ALLOW_METHODS: list = ["*"]
     CORS_ALLOW_HEADERS: list = ["*"]
     
+    # 响应压缩配置（按 Accept-Encoding 协商 br/gzip，br 需安装 brotli）
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    GZIP_COMPRESSION_LEVEL: int = 6
+    BROTLI_COMPRESSION_QUALITY: int = 4
+
+    # 流式列表响应配置
+    STREAM_BATCH_SIZE: int = 100
+
+    # 写入模式：sync 同步提交数据库；spool 先写入本地写前日志并返回 202，由后台批量刷写
+    INGEST_MODE: str = "sync"
+    SPOOL_DIR: str = "./spool"
+    SPOOL_FSYNC_INTERVAL_MS: int = 10
+    SPOOL_FLUSH_INTERVAL: float = 1.0
+    SPOOL_MAX_BATCH: int = 500
+    SPOOL_MAX_ATTEMPTS: int = 3
+
     # 日志配置
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
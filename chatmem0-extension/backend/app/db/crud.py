@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy.orm import Session
+
+from app.db.stats import conversation_contribution, record_conversation_change
+from app.models.conversation import Conversation
+from app.schemas.conversation import ConversationSchema
+
+
+def parse_datetime(value: str) -> datetime:
+    """转换时间字符串为datetime对象，统一换算为 UTC
+
+    SQLite 存储时会丢弃时区，只有统一为 UTC，读回的值与统计汇总的日期才一致。
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _is_older(value: datetime, stored: datetime) -> bool:
+    """比较 updated_at；SQLite 读回的时间不带时区，此时按存储的墙上时间比较"""
+    if (value.tzinfo is None) != (stored.tzinfo is None):
+        value = value.replace(tzinfo=None)
+        stored = stored.replace(tzinfo=None)
+    return value < stored
+
+
+def upsert_conversation(db: Session, conversation: ConversationSchema, skip_if_stale: bool = False) -> str:
+    """在当前事务中创建或更新对话（不提交），返回 "created"、"updated" 或 "skipped"
+
+    同步写入接口与写前日志的后台刷写共用此函数，调用方负责 commit/rollback。
+    统计汇总表的增量在同一事务中更新。
+    skip_if_stale=True 时，若库中记录的 updated_at 更新则不覆盖（用于重放写前日志）。
+    """
+    created_at = parse_datetime(conversation.createdAt)
+    updated_at = parse_datetime(conversation.updatedAt)
+    processed_at = parse_datetime(conversation.processedAt) if conversation.processedAt else None
+    # 模型属性名是 meta_data，数据库列名为 'metadata'；存储为JSON字符串
+    meta_data = json.dumps(conversation.metadata, ensure_ascii=False) if conversation.metadata is not None else None
+    messages = [msg.dict() for msg in conversation.messages]
+
+    existing = db.query(Conversation).filter(Conversation.id == conversation.id).first()
+    if existing and skip_if_stale and _is_older(updated_at, existing.updated_at):
+        return "skipped"
+
+    contribution = conversation_contribution(conversation.platform, created_at, messages, conversation.processed)
+
+    if existing:
+        old_contribution = conversation_contribution(
+            existing.platform, existing.created_at, existing.messages, existing.processed
+        )
+        record_conversation_change(db, old_contribution, contribution)
+
+        existing.platform = conversation.platform
+        existing.title = conversation.title
+        existing.url = conversation.url
+        existing.created_at = created_at
+        existing.updated_at = updated_at
+        existing.messages = messages
+        existing.processed = conversation.processed
+        existing.processed_at = processed_at
+        existing.tags = conversation.tags
+        existing.summary = conversation.summary
+        existing.meta_data = meta_data
+        return "updated"
+
+    record_conversation_change(db, None, contribution)
+    db.add(Conversation(
+        id=conversation.id,
+        platform=conversation.platform,
+        title=conversation.title,
+        url=conversation.url,
+        created_at=created_at,
+        updated_at=updated_at,
+        messages=messages,
+        processed=conversation.processed,
+        processed_at=processed_at,
+        tags=conversation.tags,
+        summary=conversation.summary,
+        meta_data=meta_data
+    ))
+    return "created"
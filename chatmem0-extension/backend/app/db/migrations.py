@@ -8,6 +8,10 @@ Usage examples:
 
 2) Drop and recreate all tables (DANGEROUS, wipes data):
    python -m app.db.migrations --recreate
+
+3) Recompute usage stats rollups from conversations (stop the server first:
+   the rebuild holds the database write lock for the whole scan):
+   python -m app.db.migrations --rebuild-stats
 """
 
 from __future__ import annotations
@@ -108,10 +112,31 @@ def drop_and_recreate_all_tables() -> None:
     logger.info("All tables recreated")
 
 
+def rebuild_stats_rollups() -> None:
+    """Recompute conversation_daily_stats from scratch in one transaction."""
+    from app.db.database import Base, SessionLocal
+    from app.db.stats import rebuild_stats
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        logger.info("Rebuilding stats rollups from conversations...")
+        buckets = rebuild_stats(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"Stats rollups rebuilt ({buckets} platform/day rows)")
+
+
 def main():
     parser = argparse.ArgumentParser(description="DB migration helpers")
     parser.add_argument("--rebuild", action="store_true", help="Rebuild conversations table preserving data")
     parser.add_argument("--recreate", action="store_true", help="Drop and recreate all tables (DANGEROUS)")
+    parser.add_argument("--rebuild-stats", action="store_true", help="Recompute usage stats rollups from conversations (stop the server first)")
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
@@ -120,6 +145,8 @@ def main():
         drop_and_recreate_all_tables()
     elif args.rebuild:
         rebuild_conversations_table_preserve_data()
+    elif args.rebuild_stats:
+        rebuild_stats_rollups()
     else:
         parser.print_help()
 
@@ -0,0 +1,427 @@
+"""
+Write-ahead spool for asynchronous conversation ingestion.
+
+When INGEST_MODE=spool, POST /conversations appends the validated payload to
+an append-only segment file and returns 202 once the record is fsynced.
+Appends arriving close together share one fsync (group commit).
+
+A background flusher periodically rotates the active segment and drains
+closed segments into the database one at a time, in order: records in a
+segment are coalesced so only the latest version per conversation id is
+written, in batches of SPOOL_MAX_BATCH per transaction. A segment file is
+deleted right after everything in it has been committed, so segments left
+behind by a crash are simply replayed on the next start (upserts are
+idempotent, last write wins). A spooled record is skipped when the stored
+row has a newer updated_at, so segments left over from an earlier spool run
+never overwrite rows written later in sync mode.
+
+Transient database errors (lock timeouts, disconnects and other
+OperationalError/DBAPIError) stop draining at the current segment, which is
+retried on the next pass. Only deterministic failures caused by the record
+itself (IntegrityError, DataError, ValueError) count as attempts: such a
+record is retried up to SPOOL_MAX_ATTEMPTS times and then moved to
+quarantine.log in the spool directory so it no longer blocks the records
+behind it.
+
+start() takes an exclusive flock on spool.lock in the directory, so a second
+process (another instance, or uvicorn --workers N) fails loudly instead of
+draining and deleting this process's active segment.
+
+Segment format: one JSON document per line. A torn trailing line from a crash
+mid-write is detected and skipped on replay.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，无法对目录加锁
+    fcntl = None
+
+from pydantic import ValidationError
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+
+from app.core.config import settings
+from app.db.crud import upsert_conversation
+from app.db.database import SessionLocal
+from app.schemas.conversation import ConversationSchema
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+QUARANTINE_FILE = "quarantine.log"
+LOCK_FILE = "spool.lock"
+
+
+def _segment_name(seq: int) -> str:
+    return f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}"
+
+
+def _segment_seq(name: str) -> Optional[int]:
+    if not (name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)):
+        return None
+    try:
+        return int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+    except ValueError:
+        return None
+
+
+def _is_record_error(error: Exception) -> bool:
+    """是否为记录本身导致的确定性失败（重试也不会成功）
+
+    锁等待超时（SQLite "database is locked"）、断连等 OperationalError/DBAPIError
+    属于暂时性故障，保留段等待重试，绝不计入隔离次数。
+    """
+    if isinstance(error, (IntegrityError, DataError)):
+        return True
+    if isinstance(error, DBAPIError):
+        return False
+    return isinstance(error, (ValueError, TypeError))
+
+
+def _fsync_dir(path: str) -> None:
+    """持久化目录项（新建/删除段文件），部分平台不支持时忽略"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ConversationSpool:
+    def __init__(
+        self,
+        directory: str,
+        fsync_interval: float = 0.01,
+        flush_interval: float = 1.0,
+        max_batch: int = 500,
+        max_attempts: int = 3
+    ):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+
+        self._seq = 0
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._dirty = False
+        # 写入失败且无法截断回原位置时，当前段末尾留有残片，轮换前不能再追加
+        self._poisoned = False
+        self._pending: List[asyncio.Future] = []
+        self._sync_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+        # 停止时被取消的刷写可能仍在线程池中执行，drain 需要互斥
+        self._drain_lock = threading.Lock()
+        # 数据库可用时仍写入失败的记录 id -> 失败次数
+        self._failures: Dict[str, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._acquire_directory_lock()
+        try:
+            existing = self._segment_seqs()
+            self._seq = (max(existing) + 1) if existing else 1
+            self._fd = self._create_segment(self._seq)
+        except Exception:
+            self._release_directory_lock()
+            raise
+        if existing:
+            logger.info(f"Spool: {len(existing)} segment(s) found, replaying into database")
+
+        self._sync_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._sync_loop()),
+            asyncio.create_task(self._flush_loop()),
+        ]
+        logger.info(f"Spool started at {self.directory}")
+
+    async def stop(self) -> None:
+        if not self._running:
+            return
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # 最后一次刷写：关闭活动段并尽量全部写入数据库，失败的段留待下次启动重放
+        await self._sync(close=True)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.drain)
+        except Exception as e:
+            logger.error(f"Spool final flush failed, segments kept for replay: {str(e)}")
+        self._release_directory_lock()
+        logger.info("Spool stopped")
+
+    async def append(self, payload: dict) -> None:
+        """追加一条记录，在其 fsync 落盘后返回"""
+        if not self._running:
+            raise RuntimeError("Spool is not running")
+        if self._poisoned:
+            raise RuntimeError("Spool segment is unusable until the next rotation")
+
+        data = (json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        # 事件循环内同步写入，保证与段轮换之间的原子性
+        offset = os.lseek(self._fd, 0, os.SEEK_END)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+        except OSError:
+            # 部分写入（ENOSPC、EIO）会留下残片，下一条记录会与之拼成损坏的一行
+            try:
+                os.ftruncate(self._fd, offset)
+            except OSError as e:
+                logger.error(f"Spool: cannot truncate partial record, rotating segment: {str(e)}")
+                self._poisoned = True
+                self._wakeup.set()
+            raise
+        self._dirty = True
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._wakeup.set()
+        await future
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            # 等待一个批处理窗口，让并发的追加共享一次 fsync
+            await asyncio.sleep(self.fsync_interval)
+            await self._sync()
+
+    async def _flush_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if self._dirty or self._poisoned:
+                    await self._sync(rotate=True)
+                await loop.run_in_executor(None, self.drain)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Spool flush failed, will retry: {str(e)}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def _sync(self, rotate: bool = False, close: bool = False) -> None:
+        async with self._sync_lock:
+            fd = self._fd
+            if fd is None:
+                return
+
+            # 先创建新段：失败时不改动任何状态，退化为对当前段的普通 fsync
+            new_fd = None
+            if rotate:
+                try:
+                    new_fd = self._create_segment(self._seq + 1)
+                except OSError as e:
+                    logger.error(f"Spool segment rotation failed, keeping current segment: {str(e)}")
+                    rotate = False
+
+            # 原子地取走待确认的追加并（可选）切换段，之后的追加写入新段
+            pending, self._pending = self._pending, []
+            if rotate:
+                self._seq += 1
+                self._fd = new_fd
+                self._dirty = False
+                self._poisoned = False
+            elif close:
+                self._fd = None
+            swapped = rotate or close
+
+            error: Optional[BaseException] = None
+            try:
+                if pending or swapped:
+                    await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+            except asyncio.CancelledError:
+                # 停止时被取消：同步完成 fsync，再确认等待中的追加
+                try:
+                    os.fsync(fd)
+                except OSError as e:
+                    error = e
+                raise
+            except Exception as e:
+                logger.error(f"Spool fsync failed: {str(e)}")
+                error = e
+            finally:
+                if swapped:
+                    os.close(fd)
+                for future in pending:
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(None)
+
+    def _acquire_directory_lock(self) -> None:
+        """独占 SPOOL_DIR：多个进程（如 uvicorn --workers N）共用目录会互相删除对方的活动段"""
+        if fcntl is None:
+            logger.warning("Spool: fcntl unavailable, SPOOL_DIR must not be shared between processes")
+            return
+        path = os.path.join(self.directory, LOCK_FILE)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            raise RuntimeError(
+                f"Spool directory {self.directory} is already in use by another process; "
+                "run a single worker per SPOOL_DIR"
+            )
+        self._lock_fd = fd
+
+    def _release_directory_lock(self) -> None:
+        if self._lock_fd is not None:
+            # 关闭文件描述符即释放 flock
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _create_segment(self, seq: int) -> int:
+        path = os.path.join(self.directory, _segment_name(seq))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _fsync_dir(self.directory)
+        return fd
+
+    def _segment_seqs(self) -> List[int]:
+        seqs = []
+        for name in os.listdir(self.directory):
+            seq = _segment_seq(name)
+            if seq is not None:
+                seqs.append(seq)
+        return sorted(seqs)
+
+    def _read_segment(self, path: str, latest: Dict[str, ConversationSchema]) -> None:
+        with open(path, "rb") as f:
+            for lineno, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    logger.warning(f"Spool: skipping torn trailing record in {path}")
+                    break
+                try:
+                    conversation = ConversationSchema(**json.loads(line))
+                except (ValueError, TypeError, ValidationError):
+                    logger.warning(f"Spool: skipping corrupt record {path}:{lineno}")
+                    continue
+                # 按日志顺序，后写入的版本覆盖先前版本
+                latest.pop(conversation.id, None)
+                latest[conversation.id] = conversation
+
+    def drain(self) -> int:
+        """按顺序逐段写入数据库，每段提交后即删除，返回写入的对话数（同步执行）
+
+        数据库不可用时抛出异常并保留当前段及之后的段，下次刷写重试。
+        """
+        with self._drain_lock:
+            # 活动段（_fd 打开时的当前段）仍在写入，不参与刷写
+            active = self._seq if self._fd is not None else None
+            closed = [seq for seq in self._segment_seqs() if seq != active]
+
+            total = 0
+            for seq in closed:
+                path = os.path.join(self.directory, _segment_name(seq))
+                count = self._drain_segment(path)
+                os.remove(path)
+                _fsync_dir(self.directory)
+                total += count
+                if count:
+                    logger.info(f"Spool: flushed {count} conversation(s) from {path}")
+            return total
+
+    def _drain_segment(self, path: str) -> int:
+        latest: Dict[str, ConversationSchema] = {}
+        self._read_segment(path, latest)
+        conversations = list(latest.values())
+
+        retry = False
+        for start in range(0, len(conversations), self.max_batch):
+            batch = conversations[start:start + self.max_batch]
+            try:
+                self._apply_batch(batch)
+                continue
+            except Exception as e:
+                if not _is_record_error(e):
+                    raise
+            # 批次因某条记录本身的问题失败：逐条写入，定位持续失败的记录
+            for conversation in batch:
+                if not self._apply_one(conversation):
+                    retry = True
+
+        if retry:
+            raise RuntimeError(f"Some records in {path} failed and will be retried")
+        return len(conversations)
+
+    def _apply_one(self, conversation: ConversationSchema) -> bool:
+        try:
+            self._apply_batch([conversation])
+            self._failures.pop(conversation.id, None)
+            return True
+        except Exception as e:
+            if not _is_record_error(e):
+                raise
+            attempts = self._failures.get(conversation.id, 0) + 1
+            if attempts < self.max_attempts:
+                self._failures[conversation.id] = attempts
+                logger.warning(f"Spool: record {conversation.id} failed ({attempts}/{self.max_attempts}): {str(e)}")
+                return False
+            # 多次失败的记录移入隔离文件，不再阻塞后续记录
+            self._failures.pop(conversation.id, None)
+            self._quarantine(conversation, e)
+            return True
+
+    def _quarantine(self, conversation: ConversationSchema, error: Exception) -> None:
+        path = os.path.join(self.directory, QUARANTINE_FILE)
+        data = (json.dumps(conversation.dict(), ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        logger.error(f"Spool: record {conversation.id} quarantined to {path}: {str(error)}")
+
+    def _apply_batch(self, conversations: List[ConversationSchema]) -> None:
+        db = SessionLocal()
+        try:
+            for conversation in conversations:
+                # 写前日志可能早于库中记录（如期间切换到 sync 模式写入过），不能覆盖更新的数据
+                upsert_conversation(db, conversation, skip_if_stale=True)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+
+conversation_spool = ConversationSpool(
+    settings.SPOOL_DIR,
+    fsync_interval=settings.SPOOL_FSYNC_INTERVAL_MS / 1000,
+    flush_interval=settings.SPOOL_FLUSH_INTERVAL,
+    max_batch=settings.SPOOL_MAX_BATCH,
+    max_attempts=settings.SPOOL_MAX_ATTEMPTS
+)
@@ -0,0 +1,143 @@
+"""
+Incrementally maintained usage rollups.
+
+conversation_daily_stats holds one row per (platform, day), where day is the
+UTC date of the conversation's createdAt. Every create/update applies the
+difference between the old and new contribution of the conversation inside
+the same transaction as the upsert, so GET /stats only reads the rollup table
+and never scans conversations.
+
+Rollups can be recomputed from scratch with:
+   python -m app.db.migrations --rebuild-stats
+The rebuild holds the write lock for its whole scan of conversations, so
+stop the server first: request handlers would block on the lock and fail.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.models.conversation import Conversation
+from app.models.stats import ConversationDailyStats
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("conversations", "processed_conversations", "messages", "message_chars")
+
+StatsKey = Tuple[str, date]
+
+
+def utc_day(value: datetime) -> date:
+    """统一按 UTC 取日期；不带时区的值（SQLite 读回）视为 UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).date()
+
+
+def conversation_contribution(
+    platform: str,
+    created_at: datetime,
+    messages: Iterable[dict],
+    processed: Optional[bool]
+) -> Tuple[StatsKey, Dict[str, int]]:
+    """单个对话对汇总表的贡献：(platform, day) 及各计数"""
+    messages = list(messages or [])
+    return (platform, utc_day(created_at)), {
+        "conversations": 1,
+        "processed_conversations": 1 if processed else 0,
+        "messages": len(messages),
+        "message_chars": sum(len(msg.get("content") or "") for msg in messages),
+    }
+
+
+def apply_stats_delta(db: Session, key: StatsKey, delta: Dict[str, int]) -> None:
+    """以 INSERT ... ON CONFLICT DO UPDATE 原子地累加计数（不提交）"""
+    if not any(delta.values()):
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        insert = sqlite_insert
+    elif dialect == "postgresql":
+        insert = postgresql_insert
+    else:
+        raise RuntimeError(f"Stats rollups are not supported for dialect: {dialect}")
+
+    table = ConversationDailyStats.__table__
+    platform, day = key
+    stmt = insert(table).values(platform=platform, day=day, **delta)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.platform, table.c.day],
+        set_={
+            **{name: table.c[name] + stmt.excluded[name] for name in COUNTERS},
+            "db_updated_at": func.now(),
+        }
+    )
+    db.execute(stmt)
+
+
+def record_conversation_change(
+    db: Session,
+    old: Optional[Tuple[StatsKey, Dict[str, int]]],
+    new: Tuple[StatsKey, Dict[str, int]]
+) -> None:
+    """按对话新旧贡献之差更新汇总表；old 为 None 表示新建对话"""
+    new_key, new_counts = new
+    if old is None:
+        apply_stats_delta(db, new_key, new_counts)
+        return
+
+    old_key, old_counts = old
+    if old_key == new_key:
+        apply_stats_delta(db, new_key, {name: new_counts[name] - old_counts[name] for name in COUNTERS})
+    else:
+        apply_stats_delta(db, old_key, {name: -old_counts[name] for name in COUNTERS})
+        apply_stats_delta(db, new_key, new_counts)
+
+
+def rebuild_stats(db: Session, batch_size: int = 500) -> int:
+    """清空并从 conversations 全量重算汇总表（不提交），返回汇总行数
+
+    先执行 DELETE 取得写锁，再在同一事务内读取 conversations，保证重建结果与增量一致。
+    写锁在整个扫描期间持有，运行中的服务的写入会被阻塞直至超时，重建前需先停止服务。
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {ConversationDailyStats.__tablename__} IN EXCLUSIVE MODE"))
+    db.query(ConversationDailyStats).delete()
+
+    buckets: Dict[StatsKey, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    rows = db.query(
+        Conversation.platform,
+        Conversation.created_at,
+        Conversation.messages,
+        Conversation.processed
+    ).yield_per(batch_size)
+    for platform, created_at, messages, processed in rows:
+        key, counts = conversation_contribution(platform, created_at, messages, processed)
+        for name in COUNTERS:
+            buckets[key][name] += counts[name]
+
+    db.add_all(
+        ConversationDailyStats(platform=platform, day=day, **counts)
+        for (platform, day), counts in buckets.items()
+    )
+    return len(buckets)
+
+
+def ensure_stats(db: Session) -> None:
+    """汇总表为空但已有对话时（如升级后首次启动）重建一次"""
+    has_stats = db.query(ConversationDailyStats.platform).first() is not None
+    has_conversations = db.query(Conversation.id).first() is not None
+    if has_conversations and not has_stats:
+        logger.info("Stats rollups are empty, rebuilding from conversations...")
+        rebuild_stats(db)
+        db.commit()
@@ -2,9 +2,13 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.cors import add_cors_middleware
+from app.core.compression import add_compression_middleware
 from app.core.config import settings
 from app.api.conversations import router as conversations_router
-from app.db.database import engine, Base, init_db
+from app.api.stats import router as stats_router
+from app.db.database import engine, Base, init_db, SessionLocal
+from app.db.stats import ensure_stats
+from app.db.spool import conversation_spool
 from app.schemas.conversation import ErrorResponse
 import os
 import logging
@@ -34,6 +38,9 @@ app = FastAPI(
 # 添加CORS中间件
 add_cors_middleware(app)
 
+# 添加响应压缩中间件
+add_compression_middleware(app)
+
 # 添加请求日志中间件
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -49,6 +56,7 @@ async def log_requests(request: Request, call_next):
 
 # 包含路由
 app.include_router(conversations_router, prefix="/api/v1")
+app.include_router(stats_router, prefix="/api/v1")
 
 @app.on_event("startup")
 async def on_startup():
@@ -56,6 +64,15 @@ async def on_startup():
     try:
         # 初始化数据库
         init_db()
+        # 升级后首次启动时从已有对话构建统计汇总表
+        db = SessionLocal()
+        try:
+            ensure_stats(db)
+        finally:
+            db.close()
+        # 写前日志模式：启动后台刷写，并重放上次未写入数据库的记录
+        if settings.INGEST_MODE == "spool":
+            await conversation_spool.start()
         logger.info("✅ Application started successfully")
         logger.info(f"📡 API available at http://{settings.API_HOST}:{settings.API_PORT}/api/v1")
         logger.info(f"🔍 Swagger docs at http://{settings.API_HOST}:{settings.API_PORT}/docs")
@@ -68,6 +85,7 @@ async def on_startup():
 async def on_shutdown():
     """应用关闭时的清理"""
     logger.info("🔄 Application shutting down")
+    await conversation_spool.stop()
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
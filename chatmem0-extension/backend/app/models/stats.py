@@ -0,0 +1,16 @@
+from sqlalchemy import Column, String, Date, Integer, DateTime
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+class ConversationDailyStats(Base):
+    """按平台、按天（对话 createdAt 日期）汇总的统计，随对话写入增量维护"""
+    __tablename__ = "conversation_daily_stats"
+    
+    platform = Column(String(50), primary_key=True)
+    day = Column(Date, primary_key=True)
+    conversations = Column(Integer, nullable=False, default=0)
+    processed_conversations = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)
+    message_chars = Column(Integer, nullable=False, default=0)  # 消息内容字符数之和
+    
+    db_updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,18 @@
+import os
+import tempfile
+
+# 必须在导入 app 之前设置：app.db.database 在导入时创建 engine
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="chatmem0-test-"), "test.db")
+
+import pytest
+
+from app.db.database import Base, engine
+from app.models import conversation, stats  # noqa: F401  注册表结构
+
+
+@pytest.fixture(autouse=True)
+def database():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
@@ -0,0 +1,85 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core import compression
+from app.core.compression import CompressionMiddleware
+
+LARGE = "chatmem0 " * 1000
+CHUNKS = [f"chunk {i} ".encode() * 50 for i in range(20)]
+
+
+async def small(request):
+    return PlainTextResponse("x" * 10)
+
+
+async def large(request):
+    return PlainTextResponse(LARGE)
+
+
+async def encoded(request):
+    return Response(LARGE.encode(), headers={"Content-Encoding": "identity"})
+
+
+async def streaming(request):
+    async def body():
+        for chunk in CHUNKS:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+test_app = Starlette(routes=[
+    Route("/small", small),
+    Route("/large", large),
+    Route("/encoded", encoded),
+    Route("/streaming", streaming),
+])
+test_app.add_middleware(CompressionMiddleware, minimum_size=100)
+client = TestClient(test_app)
+
+
+def test_under_threshold_is_not_compressed():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.text == "x" * 10
+
+
+def test_large_response_is_gzipped(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(LARGE)
+    assert response.text == LARGE
+
+
+def test_q_zero_refuses_encoding():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "content-encoding" not in response.headers
+    assert response.text == LARGE
+
+
+def test_brotli_preferred_when_available():
+    pytest.importorskip("brotli")
+    assert client.get("/large", headers={"Accept-Encoding": "gzip, br"}).headers["content-encoding"] == "br"
+    assert client.get("/large", headers={"Accept-Encoding": "gzip, br;q=0"}).headers["content-encoding"] == "gzip"
+
+
+def test_existing_content_encoding_is_left_alone():
+    response = client.get("/encoded", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "identity"
+    assert response.content == LARGE.encode()
+
+
+def test_streaming_body_is_compressed_incrementally(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    with client.stream("GET", "/streaming", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        raw = b"".join(response.iter_raw())
+    assert gzip.decompress(raw) == b"".join(CHUNKS)
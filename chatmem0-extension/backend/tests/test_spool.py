@@ -0,0 +1,307 @@
+import asyncio
+import errno
+import json
+import os
+import threading
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import app.db.spool as spool_module
+from app.db.crud import upsert_conversation
+from app.db.database import SessionLocal
+from app.db.spool import QUARANTINE_FILE, ConversationSpool, _segment_name
+from app.models.conversation import Conversation
+from app.schemas.conversation import ConversationSchema
+
+
+def make_conversation(conversation_id: str, title: str = "t", updated_at: str = "2024-01-01T00:00:00Z") -> dict:
+    return {
+        "id": conversation_id,
+        "platform": "claude",
+        "title": title,
+        "url": "https://claude.ai/chat/" + conversation_id,
+        "createdAt": "2024-01-01T00:00:00Z",
+        "updatedAt": updated_at,
+        "messages": [{
+            "id": "m1",
+            "role": "user",
+            "content": "hello",
+            "contentType": "text",
+            "timestamp": "2024-01-01T00:00:00Z"
+        }],
+        "processed": False
+    }
+
+
+def stored_title(conversation_id: str):
+    db = SessionLocal()
+    try:
+        conversation = db.get(Conversation, conversation_id)
+        return conversation.title if conversation else None
+    finally:
+        db.close()
+
+
+def segment_files(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+@pytest.fixture
+def spool_dir(tmp_path):
+    return tmp_path / "spool"
+
+
+@pytest_asyncio.fixture
+async def spool(spool_dir):
+    instance = ConversationSpool(str(spool_dir), fsync_interval=0, flush_interval=3600, max_attempts=2)
+    await instance.start()
+    # 停掉后台刷写，测试里手动触发轮换和 drain，避免与其在线程池中的 drain 竞争
+    flush_task = instance._tasks[1]
+    flush_task.cancel()
+    await asyncio.gather(flush_task, return_exceptions=True)
+    yield instance
+    await instance.stop()
+
+
+@pytest.mark.asyncio
+async def test_append_returns_only_after_fsync(spool, monkeypatch):
+    gate = threading.Event()
+    synced = []
+    real_fsync = os.fsync
+
+    def gated_fsync(fd):
+        gate.wait(5)
+        synced.append(fd)
+        real_fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", gated_fsync)
+
+    task = asyncio.create_task(spool.append(make_conversation("c1")))
+    await asyncio.sleep(0.2)
+    assert not task.done()
+
+    gate.set()
+    await asyncio.wait_for(task, 5)
+    assert spool._fd in synced
+
+
+@pytest.mark.asyncio
+async def test_drain_coalesces_to_latest_version(spool, spool_dir):
+    await spool.append(make_conversation("c1", title="v1"))
+    await spool.append(make_conversation("c1", title="v2"))
+    await spool.append(make_conversation("c2"))
+    await spool._sync(rotate=True)
+
+    assert spool.drain() == 2
+    assert stored_title("c1") == "v2"
+    assert stored_title("c2") == "t"
+    # 只剩下当前活动段
+    assert segment_files(spool_dir) == [_segment_name(spool._seq)]
+
+
+@pytest.mark.asyncio
+async def test_leftover_segment_is_replayed_and_torn_record_skipped(spool_dir):
+    spool_dir.mkdir()
+    with open(spool_dir / _segment_name(3), "w") as f:
+        f.write(json.dumps(make_conversation("c1", title="old")) + "\n")
+        f.write(json.dumps(make_conversation("c1", title="new")) + "\n")
+        f.write(json.dumps(make_conversation("c2"))[:40])
+
+    instance = ConversationSpool(str(spool_dir), fsync_interval=0, flush_interval=3600)
+    await instance.start()
+    assert instance._seq == 4
+    await instance.stop()
+
+    assert stored_title("c1") == "new"
+    assert stored_title("c2") is None
+    assert segment_files(spool_dir) == []
+
+
+@pytest.mark.asyncio
+async def test_segment_is_kept_until_commit(spool, spool_dir, monkeypatch):
+    await spool.append(make_conversation("c1"))
+    await spool._sync(rotate=True)
+    closed = _segment_name(spool._seq - 1)
+
+    unreachable = sessionmaker(bind=create_engine(f"sqlite:///{spool_dir}/missing/db.sqlite"))
+    monkeypatch.setattr(spool_module, "SessionLocal", unreachable)
+    with pytest.raises(Exception):
+        spool.drain()
+    assert closed in segment_files(spool_dir)
+
+    monkeypatch.setattr(spool_module, "SessionLocal", SessionLocal)
+    assert spool.drain() == 1
+    assert closed not in segment_files(spool_dir)
+    assert stored_title("c1") == "t"
+
+
+@pytest.mark.asyncio
+async def test_record_that_keeps_failing_is_quarantined(spool, spool_dir, monkeypatch):
+    def failing_upsert(db, conversation, **kwargs):
+        if conversation.id == "bad":
+            raise ValueError("cannot store")
+        return upsert_conversation(db, conversation, **kwargs)
+
+    monkeypatch.setattr(spool_module, "upsert_conversation", failing_upsert)
+
+    await spool.append(make_conversation("bad"))
+    await spool.append(make_conversation("good"))
+    await spool._sync(rotate=True)
+    closed = _segment_name(spool._seq - 1)
+
+    # 第一次失败：其余记录照常写入，段保留待重试
+    with pytest.raises(RuntimeError):
+        spool.drain()
+    assert stored_title("good") == "t"
+    assert closed in segment_files(spool_dir)
+
+    # 达到 max_attempts 后移入隔离文件，段被删除
+    spool.drain()
+    assert closed not in segment_files(spool_dir)
+    with open(spool_dir / QUARANTINE_FILE) as f:
+        assert [json.loads(line)["id"] for line in f] == ["bad"]
+
+
+@pytest.mark.asyncio
+async def test_locked_database_never_quarantines(spool, spool_dir, monkeypatch):
+    locked = [True]
+
+    def locked_upsert(db, conversation, **kwargs):
+        if locked[0]:
+            raise OperationalError("UPDATE conversations", {}, Exception("database is locked"))
+        return upsert_conversation(db, conversation, **kwargs)
+
+    monkeypatch.setattr(spool_module, "upsert_conversation", locked_upsert)
+
+    await spool.append(make_conversation("c1"))
+    await spool._sync(rotate=True)
+    closed = _segment_name(spool._seq - 1)
+
+    # 锁等待超时属于暂时性故障：无论重试多少次都保留段，不进入隔离文件
+    for _ in range(spool.max_attempts + 2):
+        with pytest.raises(OperationalError):
+            spool.drain()
+    assert closed in segment_files(spool_dir)
+    assert not (spool_dir / QUARANTINE_FILE).exists()
+
+    locked[0] = False
+    assert spool.drain() == 1
+    assert stored_title("c1") == "t"
+
+
+@pytest.mark.asyncio
+async def test_spooled_record_does_not_overwrite_newer_row(spool):
+    db = SessionLocal()
+    try:
+        upsert_conversation(db, ConversationSchema(**make_conversation(
+            "c1", title="sync", updated_at="2024-02-01T00:00:00Z"
+        )))
+        db.commit()
+    finally:
+        db.close()
+
+    await spool.append(make_conversation("c1", title="spooled", updated_at="2024-01-01T00:00:00Z"))
+    await spool._sync(rotate=True)
+    spool.drain()
+
+    assert stored_title("c1") == "sync"
+
+
+@pytest.mark.asyncio
+async def test_rotation_failure_resolves_appends_and_keeps_active_segment(spool, spool_dir, monkeypatch):
+    spool.fsync_interval = 3600  # append 只能由下面的轮换确认
+    seq = spool._seq
+    task = asyncio.create_task(spool.append(make_conversation("c1")))
+    await asyncio.sleep(0.05)
+
+    real_open = os.open
+    failed = []
+
+    def failing_open(path, *args, **kwargs):
+        if str(path).endswith(_segment_name(seq + 1)) and not failed:
+            failed.append(path)
+            raise OSError(errno.EMFILE, "Too many open files")
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "open", failing_open)
+    await spool._sync(rotate=True)
+    monkeypatch.setattr(os, "open", real_open)
+
+    assert failed
+    await asyncio.wait_for(task, 1)
+    assert spool._seq == seq
+    # 活动段不能被当作已关闭的段删除
+    assert spool.drain() == 0
+    assert segment_files(spool_dir) == [_segment_name(seq)]
+
+    await spool._sync(rotate=True)
+    assert spool.drain() == 1
+    assert stored_title("c1") == "t"
+
+
+@pytest.mark.asyncio
+async def test_second_process_cannot_share_spool_directory(spool, spool_dir):
+    other = ConversationSpool(str(spool_dir), fsync_interval=0, flush_interval=3600)
+    with pytest.raises(RuntimeError, match="already in use"):
+        await other.start()
+    assert segment_files(spool_dir) == [_segment_name(spool._seq)]
+
+    await spool.stop()
+    await other.start()
+    await other.stop()
+
+
+def fail_write_once(monkeypatch):
+    """让下一次 os.write 只写入一半后以 ENOSPC 失败"""
+    real_write = os.write
+    failed = []
+
+    def partial_write(fd, data):
+        if not failed:
+            failed.append(fd)
+            real_write(fd, bytes(data[:len(data) // 2]))
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return real_write(fd, data)
+
+    monkeypatch.setattr(os, "write", partial_write)
+
+
+@pytest.mark.asyncio
+async def test_partial_write_is_truncated(spool, monkeypatch):
+    await spool.append(make_conversation("c1"))
+    fail_write_once(monkeypatch)
+    with pytest.raises(OSError):
+        await spool.append(make_conversation("c2"))
+    await spool.append(make_conversation("c3"))
+    await spool._sync(rotate=True)
+
+    assert spool.drain() == 2
+    assert stored_title("c1") == "t"
+    assert stored_title("c2") is None
+    assert stored_title("c3") == "t"
+
+
+@pytest.mark.asyncio
+async def test_untruncatable_partial_write_rotates_segment(spool, monkeypatch):
+    fail_write_once(monkeypatch)
+
+    def failing_ftruncate(fd, length):
+        raise OSError(errno.EIO, "I/O error")
+
+    monkeypatch.setattr(os, "ftruncate", failing_ftruncate)
+    with pytest.raises(OSError):
+        await spool.append(make_conversation("c1"))
+    # 残片之后不能再追加，直到轮换到新段
+    with pytest.raises(RuntimeError):
+        await spool.append(make_conversation("c2"))
+
+    await spool._sync(rotate=True)
+    await spool.append(make_conversation("c3"))
+    await spool._sync(rotate=True)
+
+    assert spool.drain() == 1
+    assert stored_title("c3") == "t"
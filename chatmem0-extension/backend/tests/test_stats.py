@@ -0,0 +1,173 @@
+from fastapi.testclient import TestClient
+
+from app.db.crud import upsert_conversation
+from app.db.database import SessionLocal
+from app.db.stats import COUNTERS, rebuild_stats
+from app.models.stats import ConversationDailyStats
+from app.main import app
+from app.schemas.conversation import ConversationSchema
+
+
+def make_conversation(
+    conversation_id: str,
+    platform: str = "claude",
+    created_at: str = "2024-01-01T10:00:00Z",
+    messages: int = 1,
+    processed: bool = False
+) -> dict:
+    return {
+        "id": conversation_id,
+        "platform": platform,
+        "title": "t",
+        "url": "https://example.com/" + conversation_id,
+        "createdAt": created_at,
+        "updatedAt": created_at,
+        "messages": [{
+            "id": f"m{i}",
+            "role": "user",
+            "content": "x" * (i + 1),
+            "contentType": "text",
+            "timestamp": "2024-01-01T00:00:00Z"
+        } for i in range(messages)],
+        "processed": processed
+    }
+
+
+def upsert(**kwargs):
+    db = SessionLocal()
+    try:
+        upsert_conversation(db, ConversationSchema(**make_conversation(**kwargs)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def rollups() -> dict:
+    """(platform, 'YYYY-MM-DD') -> 计数，忽略全为 0 的行"""
+    db = SessionLocal()
+    try:
+        rows = db.query(ConversationDailyStats).all()
+        return {
+            (row.platform, row.day.isoformat()): {name: getattr(row, name) for name in COUNTERS}
+            for row in rows
+            if any(getattr(row, name) for name in COUNTERS)
+        }
+    finally:
+        db.close()
+
+
+def rebuilt_rollups() -> dict:
+    db = SessionLocal()
+    try:
+        rebuild_stats(db)
+        db.commit()
+    finally:
+        db.close()
+    return rollups()
+
+
+def counts(conversations: int = 1, processed: int = 0, messages: int = 1, message_chars: int = 1) -> dict:
+    return {
+        "conversations": conversations,
+        "processed_conversations": processed,
+        "messages": messages,
+        "message_chars": message_chars,
+    }
+
+
+def test_create_adds_to_bucket():
+    upsert(conversation_id="c1", messages=2)
+    upsert(conversation_id="c2", messages=1)
+
+    assert rollups() == {("claude", "2024-01-01"): counts(conversations=2, messages=3, message_chars=4)}
+
+
+def test_update_applies_message_count_delta():
+    upsert(conversation_id="c1", messages=1)
+    upsert(conversation_id="c1", messages=3)
+
+    assert rollups() == {("claude", "2024-01-01"): counts(messages=3, message_chars=6)}
+
+
+def test_update_moving_platform_and_day_decrements_old_bucket():
+    upsert(conversation_id="c1", messages=2)
+    upsert(conversation_id="c2")
+    upsert(conversation_id="c1", platform="chatgpt", created_at="2024-01-05T10:00:00Z", messages=2)
+
+    assert rollups() == {
+        ("claude", "2024-01-01"): counts(),
+        ("chatgpt", "2024-01-05"): counts(messages=2, message_chars=3),
+    }
+
+
+def test_processed_flip():
+    upsert(conversation_id="c1")
+    upsert(conversation_id="c1", processed=True)
+    assert rollups() == {("claude", "2024-01-01"): counts(processed=1)}
+
+    upsert(conversation_id="c1", processed=False)
+    assert rollups() == {("claude", "2024-01-01"): counts()}
+
+
+def test_rebuild_matches_incremental_rollups():
+    upsert(conversation_id="c1", messages=3)
+    upsert(conversation_id="c2", platform="chatgpt", processed=True)
+    upsert(conversation_id="c3", created_at="2024-01-02T10:00:00Z", messages=2)
+    upsert(conversation_id="c1", platform="chatgpt", created_at="2024-01-03T10:00:00Z", messages=1)
+    upsert(conversation_id="c2", platform="chatgpt", processed=False, messages=4)
+
+    incremental = rollups()
+    assert rebuilt_rollups() == incremental
+
+
+def test_stats_endpoint_filters():
+    upsert(conversation_id="c1", messages=2, processed=True)
+    upsert(conversation_id="c2", created_at="2024-01-02T10:00:00Z", messages=4)
+    upsert(conversation_id="c3", platform="chatgpt", created_at="2024-01-02T10:00:00Z")
+    upsert(conversation_id="c4", platform="chatgpt", created_at="2024-01-03T10:00:00Z")
+
+    client = TestClient(app)
+    stats = client.get("/api/v1/stats").json()
+    assert stats["totals"] == {
+        "conversations": 4,
+        "processed": 1,
+        "unprocessed": 3,
+        "messages": 8,
+        "avgMessagesPerConversation": 2.0,
+        "avgMessageSize": 1.88,
+    }
+    assert [p["platform"] for p in stats["platforms"]] == ["chatgpt", "claude"]
+    assert [(d["day"], d["platform"]) for d in stats["daily"]] == [
+        ("2024-01-01", "claude"),
+        ("2024-01-02", "chatgpt"),
+        ("2024-01-02", "claude"),
+        ("2024-01-03", "chatgpt"),
+    ]
+
+    claude = client.get("/api/v1/stats", params={"platform": "claude"}).json()
+    assert claude["totals"]["conversations"] == 2
+    assert claude["totals"]["messages"] == 6
+    assert [p["platform"] for p in claude["platforms"]] == ["claude"]
+
+    window = client.get("/api/v1/stats", params={"start": "2024-01-02", "end": "2024-01-02"}).json()
+    assert window["totals"]["conversations"] == 2
+    assert [(d["day"], d["platform"]) for d in window["daily"]] == [
+        ("2024-01-02", "chatgpt"),
+        ("2024-01-02", "claude"),
+    ]
+
+    empty = client.get("/api/v1/stats", params={"platform": "yiyan"}).json()
+    assert empty["totals"]["conversations"] == 0
+    assert empty["platforms"] == [] and empty["daily"] == []
+
+
+def test_day_is_utc_date_of_created_at():
+    # 2024-01-01 22:00 -05:00 即 2024-01-02 03:00 UTC
+    upsert(conversation_id="c1", created_at="2024-01-01T22:00:00-05:00")
+    upsert(conversation_id="c1", created_at="2024-01-01T22:00:00-05:00", messages=2)
+
+    expected = {("claude", "2024-01-02"): {
+        "conversations": 1, "processed_conversations": 0, "messages": 2, "message_chars": 3
+    }}
+    assert rollups() == expected
+    assert rebuilt_rollups() == expected
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.api.conversations as conversations_api
+from app.core.config import settings
+from app.db.crud import upsert_conversation
+from app.db.database import SessionLocal
+from app.main import app
+from app.schemas.conversation import ConversationSchema
+
+client = TestClient(app)
+
+
+def insert_conversations(count: int, updated_at=lambda i: f"2024-01-01T00:{i % 3:02d}:00Z"):
+    db = SessionLocal()
+    try:
+        for i in range(count):
+            upsert_conversation(db, ConversationSchema(
+                id=f"c{i:02d}",
+                platform="claude",
+                title="t",
+                url="https://claude.ai/chat/" + str(i),
+                createdAt="2024-01-01T00:00:00Z",
+                updatedAt=updated_at(i),
+                messages=[{
+                    "id": "m1",
+                    "role": "user",
+                    "content": "hello",
+                    "contentType": "text",
+                    "timestamp": "2024-01-01T00:00:00Z"
+                }],
+                processed=False
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def listed_ids(params: dict) -> list:
+    response = client.get("/api/v1/conversations", params=params)
+    assert response.status_code == 200
+    return [conv["id"] for conv in response.json()]
+
+
+def streamed_ids(params: dict, stream: str) -> list:
+    response = client.get("/api/v1/conversations", params={**params, "stream": stream})
+    assert response.status_code == 200
+    if stream == "json":
+        return [conv["id"] for conv in json.loads(response.content)]
+    return [json.loads(line)["id"] for line in response.text.splitlines()]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(settings, "STREAM_BATCH_SIZE", 3)
+
+
+@pytest.mark.parametrize("skip,limit", [(0, 100), (2, 5), (4, 3), (0, 6), (9, 10), (20, 5)])
+@pytest.mark.parametrize("stream", ["json", "ndjson"])
+def test_stream_matches_listing(stream, skip, limit):
+    insert_conversations(11)
+    params = {"skip": skip, "limit": limit}
+
+    expected = listed_ids(params)
+    assert streamed_ids(params, stream) == expected
+    assert len(expected) == max(0, min(limit, 11 - skip))
+
+
+def test_empty_result():
+    assert client.get("/api/v1/conversations", params={"stream": "json"}).content == b"[]"
+    assert client.get("/api/v1/conversations", params={"stream": "ndjson"}).content == b""
+
+
+def test_keyset_pagination_with_tied_updated_at():
+    insert_conversations(8, updated_at=lambda i: "2024-01-01T00:00:00Z")
+
+    ids = streamed_ids({"limit": 100}, "ndjson")
+    # updated_at 全部相同时按 id 倒序，跨批次不重复、不遗漏
+    assert ids == [f"c{i:02d}" for i in reversed(range(8))]
+    assert streamed_ids({"skip": 1, "limit": 5}, "json") == ids[1:6]
+
+
+def test_first_batch_error_returns_500(monkeypatch):
+    def failing_fetch(*args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(conversations_api, "fetch_stream_batch", failing_fetch)
+    response = client.get("/api/v1/conversations", params={"stream": "json"})
+    assert response.status_code == 500